@@ -3,11 +3,11 @@ import pandas as pd
 from pathlib import Path
 from tqdm import tqdm
 from collections import Counter
-from common import load_config, SanityCheckError
+from common import find_named, load_config, SanityCheckError
 
 def find_mewc_out_files(service_directory, mewc_filename):
     """Find all mewc files in the service directory using specified filename."""
-    mewc_files = list(Path(service_directory).rglob(mewc_filename))
+    mewc_files = list(find_named(service_directory, mewc_filename))
     return mewc_files
 
 def perform_sanity_checks(mewc_files):
@@ -49,7 +49,8 @@ def create_species_breakout(mewc_files, classified_snips_path, probability_bins)
             print(f"Warning: 'snips' directory not found in {camera_site}")
             continue
             
-        mewc_df = pd.read_csv(mewc_file)
+        # Only the columns needed to place each snip are parsed
+        mewc_df = pd.read_csv(mewc_file, engine='pyarrow', usecols=['rand_name', 'class_name', 'prob'])
         for _, row in mewc_df.iterrows():
             rand_name = row['rand_name']
             class_name = row['class_name']
@@ -1,8 +1,10 @@
-import shutil, pickle
+import os, shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 from tqdm import tqdm
-from common import load_config, SanityCheckError
+from common import create_base_filename, find_named, is_sorted, load_config, strip_suffix_series, write_csv, write_parquet, SanityCheckError
 
 class SanityCheckError(Exception):
     """Custom exception for sanity check failures."""
@@ -13,83 +15,91 @@ def sanity_check_species_breakout(classified_snips_path):
     Ensure that each species folder is flat and contains at least one snip.
     Abort if any species folder contains subfolders with snips.
     Delete empty subfolders or empty species folders if any.
+    Returns a dict of species name -> snip filenames, so the folders are only listed once.
     """
     print("Checking format and completion of expert-checked species breakout directory...")
     species_folders = [f for f in Path(classified_snips_path).iterdir() if f.is_dir()]
+    species_snips = {}
 
     # Check for subfolders and delete if empty
     for species in tqdm(species_folders, desc="Checking species folders"):
-        subfolders = [sub for sub in species.iterdir() if sub.is_dir()]
-        for sub in subfolders:
-            snip_files = list(sub.glob("*.*"))  # Assuming snips have file extensions
-            if snip_files:
-                raise SanityCheckError(
-                    "Aborted: One or more subfolders of the species breakout have not been sorted into their species folders. "
-                    "Please complete the task before continuing."
-                )
-            else:
-                shutil.rmtree(sub)  # Delete empty subfolder
-
-        # Check if the species folder itself is empty and delete if needed
-        if not any(species.iterdir()):  # Check if the folder is now empty
+        snips = []
+        has_files = False
+        with os.scandir(species) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if any(Path(entry.path).glob("*.*")):  # Assuming snips have file extensions
+                        raise SanityCheckError(
+                            "Aborted: One or more subfolders of the species breakout have not been sorted into their species folders. "
+                            "Please complete the task before continuing."
+                        )
+                    shutil.rmtree(entry.path)  # Delete empty subfolder
+                else:
+                    has_files = True
+                    if '.' in entry.name:
+                        snips.append(entry.name)
+
+        # Delete the species folder if it is now empty
+        if not has_files:
             shutil.rmtree(species)
+        else:
+            species_snips[species.name] = snips
 
     print("Check passed. Species breakout directory is properly organised.\n")
+    return species_snips
 
-def create_randname_classname_table(classified_snips_path):
+def create_randname_classname_table(species_snips):
     """
-    Create a DataFrame mapping rand_name (filename) to class_name (species).
+    Create a DataFrame mapping rand_name (filename) to class_name (species),
+    from the species name -> snip filenames dict returned by the sanity check.
     """
     print("Creating rand_name : class_name keypair table...")
-    data = []
-    species_folders = [f for f in Path(classified_snips_path).iterdir() if f.is_dir()]
-    for species in tqdm(species_folders, desc="Processing species folders"):
-        snip_files = list(species.glob("*.*"))  # Assuming snips have file extensions
-        for snip in snip_files:
-            data.append({
-                'rand_name': snip.name,
-                'class_name': species.name
-            })
-    df = pd.DataFrame(data)
+    df = pd.DataFrame({
+        'rand_name': [snip for snips in species_snips.values() for snip in snips],
+        'class_name': [species for species, snips in species_snips.items() for _ in snips]
+    })
     print(f"Created keypair table with {len(df)} entries.\n")
     return df
 
-def create_consolidated_species_table(service_directory):
+def read_mewc_file(mewc_file):
+    """Read one mewc_out.csv and tag its rows with the camera_site; return None if it can't be read."""
+    # Determine the camera_site based on the directory structure
+    # Example: service_directory/CameraSite/mewc_out.csv --> camera_site = 'CameraSite'
+    camera_site = mewc_file.parent.name
+
+    try:
+        df = pd.read_csv(mewc_file, engine='pyarrow')
+    except Exception as e:
+        print(f"Error reading '{mewc_file}': {e}. Skipping this file.")
+        return None
+
+    # Assign the camera_site to each row
+    df['camera_site'] = camera_site
+    return df
+
+def create_consolidated_species_table(service_directory, max_workers=None):
     """
     Combine all mewc_out.csv files into a single DataFrame with additional columns.
     After consolidation, remove unneeded columns and ensure proper naming conventions.
     
     Parameters:
     - service_directory (str or Path): Path to the directory containing all camera sites.
+    - max_workers (int): Number of threads reading files concurrently.
     
     Returns:
     - pd.DataFrame: Consolidated DataFrame ready for further processing.
     """
     print("Creating consolidated species table from all cameras...")
-    consolidated_data = []
     
     # Find all mewc_out.csv files within the service_directory tree
-    mewc_files = list(Path(service_directory).rglob("mewc_out.csv"))
+    mewc_files = list(find_named(service_directory, "mewc_out.csv"))
     print(f"Found {len(mewc_files)} 'mewc_out.csv' files.\n")
     
-    for mewc_file in tqdm(mewc_files, desc="Processing mewc_out.csv files"):
-        # Determine the camera_site based on the directory structure
-        # Adjust this as per your actual directory hierarchy
-        # Example: service_directory/CameraSite/mewc_out.csv --> camera_site = 'CameraSite'
-        camera_site = mewc_file.parent.name
-        
-        # Read the CSV file
-        try:
-            df = pd.read_csv(mewc_file)
-        except Exception as e:
-            print(f"Error reading '{mewc_file}': {e}. Skipping this file.")
-            continue
-        
-        # Assign the camera_site to each row
-        df['camera_site'] = camera_site
-        
-        # Append to the consolidated data list
-        consolidated_data.append(df)
+    # Threads overlap file I/O; Arrow's reader parses outside the GIL on its own thread pool. map keeps file order
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(tqdm(executor.map(read_mewc_file, mewc_files),
+                           total=len(mewc_files), desc="Processing mewc_out.csv files"))
+    consolidated_data = [df for df in frames if df is not None]
     
     if not consolidated_data:
         print("No data to consolidate. Exiting.")
@@ -98,10 +108,11 @@ def create_consolidated_species_table(service_directory):
     # Concatenate all DataFrames
     consolidated_df = pd.concat(consolidated_data, ignore_index=True)
       
-    # Handle the unnamed index column if it exists
-    if 'Unnamed: 0' in consolidated_df.columns:
-        # Assuming 'Unnamed: 0' is the original index, drop it
-        consolidated_df.drop(columns=['Unnamed: 0'], inplace=True)
+    # Handle the unnamed index column if it exists ('' from the pyarrow reader, 'Unnamed: 0' from the C reader)
+    unnamed_columns = [col for col in ('', 'Unnamed: 0') if col in consolidated_df.columns]
+    if unnamed_columns:
+        # Assuming the unnamed column is the original index, drop it
+        consolidated_df.drop(columns=unnamed_columns, inplace=True)
     
     # Ensure 'camera_site' is the first column
     columns = list(consolidated_df.columns)
@@ -192,8 +203,10 @@ def determine_independent_events(consolidated_df, interval_minutes=5, prob_thres
         print(f"Warning: {num_na} timestamps could not be parsed and will be excluded.")
         consolidated_df = consolidated_df.dropna(subset=['timestamp'])
 
-    # Sort the DataFrame by 'camera_site' and 'timestamp' to process chronologically
-    consolidated_df.sort_values(['camera_site', 'timestamp'], inplace=True)
+    # Sort the DataFrame by 'camera_site' and 'timestamp' to process chronologically,
+    # unless the per-site files were already concatenated in that order
+    if not is_sorted(consolidated_df, ['camera_site', 'timestamp']):
+        consolidated_df.sort_values(['camera_site', 'timestamp'], inplace=True)
     consolidated_df.reset_index(drop=True, inplace=True)
 
     # Calculate time differences within each camera_site
@@ -227,19 +240,8 @@ def determine_independent_events(consolidated_df, interval_minutes=5, prob_thres
     # Ensure that 'new_event' is False for the first snip in each camera_site
     consolidated_df['new_event'] = consolidated_df['new_event'] & (~consolidated_df['is_first_snip'])
 
-    # Initialize the 'event' column to 1
-    consolidated_df['event'] = 1
-
-    # Iterate through each camera_site group to assign event numbers
-    for camera_site, group in consolidated_df.groupby('camera_site'):
-        # Initialize event counter
-        current_event = 1
-
-        # Iterate through the rows in the group
-        for idx, row in group.iterrows():
-            if row['new_event']:
-                current_event += 1  # Increment event if new_event is True
-            consolidated_df.at[idx, 'event'] = current_event
+    # Number events within each camera_site: 1, incremented at every new_event
+    consolidated_df['event'] = consolidated_df.groupby('camera_site')['new_event'].cumsum() + 1
 
     # Clean up intermediate columns
     consolidated_df.drop(
@@ -256,64 +258,52 @@ def refine_unknown_animal_classifications(consolidated_df, prob_threshold=0.2):
     """
     print("Refining 'unknown_animal' classifications within events...")
     
-    grouped = consolidated_df.groupby(['camera_site', 'event'])
-    for (camera, event), group in tqdm(grouped, desc="Processing events"):    
-        # Identify dominant class excluding 'unknown_animal'
-        dominant_classes = group[(group['class_name'] != 'unknown_animal') & (group['prob'] >= prob_threshold)]
-       
-        # Identify 'unknown_animal' entries
-        unknown_animals = group[group['class_name'] == 'unknown_animal']
-        indices_to_replace = unknown_animals.index
-
-        if not dominant_classes.empty:
-            # Use the most frequent dominant class
-            replacement_class = dominant_classes['class_name'].mode()[0]          
-            consolidated_df.loc[indices_to_replace, 'class_name'] = replacement_class
-            # Update the probability for the replaced rows
-            highest_prob_value = group.loc[group['prob'].idxmax(), 'prob']
-            consolidated_df.loc[indices_to_replace, 'prob'] = highest_prob_value
-            # Update the expert_updated flag to 2, to indicate an automated change to unknown_animal
-            consolidated_df.loc[indices_to_replace, 'expert_updated'] = 2
+    event_keys = ['camera_site', 'event']
+    dominant = ((consolidated_df['class_name'] != 'unknown_animal')
+                & (consolidated_df['prob'] >= prob_threshold)).fillna(False)
+
+    # Most frequent dominant class per event (ties go to the first name in sort order, as Series.mode)
+    class_counts = (consolidated_df.loc[dominant, event_keys + ['class_name']]
+                    .groupby(event_keys + ['class_name']).size().reset_index(name='n'))
+    replacement_classes = (class_counts.sort_values(['n', 'class_name'], ascending=[False, True])
+                           .drop_duplicates(event_keys)[event_keys + ['class_name']])
+    replacement_class = consolidated_df[event_keys].merge(
+        replacement_classes, on=event_keys, how='left')['class_name'].to_numpy()
+    # Highest probability of any row in the event
+    highest_prob = consolidated_df.groupby(event_keys)['prob'].transform('max').to_numpy()
+
+    # Replace 'unknown_animal' entries in events that have a dominant class
+    indices_to_replace = ((consolidated_df['class_name'] == 'unknown_animal').fillna(False).to_numpy()
+                          & pd.notna(replacement_class))
+    consolidated_df.loc[indices_to_replace, 'class_name'] = replacement_class[indices_to_replace]
+    consolidated_df.loc[indices_to_replace, 'prob'] = highest_prob[indices_to_replace]
+    # Update the expert_updated flag to 2, to indicate an automated change to unknown_animal
+    consolidated_df.loc[indices_to_replace, 'expert_updated'] = 2
 
     print("Refinement of 'unknown_animal' classifications completed.\n")
     return consolidated_df
 
 def save_final_table(consolidated_df, table_path):
     """
-    Save the consolidated table as CSV and pickle.
+    Save the consolidated table as CSV and Parquet.
     """
     print("Saving the final consolidated, expert-verified ID site-speces table...")
     output_csv = Path(table_path).with_suffix(".csv")
-    output_pickle = Path(table_path).with_suffix(".pkl")
+    output_parquet = Path(table_path).with_suffix(".parquet")
     
     # Save CSV
-    consolidated_df.to_csv(output_csv, index=False)
+    write_csv(consolidated_df, output_csv)
     print(f"Saved consolidated table to {output_csv}")
     
-    # Save pickle
-    with open(output_pickle, 'wb') as f:
-        pickle.dump(consolidated_df, f)
-    print(f"Saved consolidated table pickle to {output_pickle}")
-
-def create_base_filename(filename):
-    """
-    Create base filename by removing suffix like -0, -1, etc.
-    """
-    parts = filename.split('.')
-    if len(parts) < 2:
-        return filename
-    name, ext = '.'.join(parts[:-1]), parts[-1]
-    if '-' in name:
-        base_name = name.rsplit('-', 1)[0] + '.' + ext
-    else:
-        base_name = filename
-    return base_name
+    # Save Parquet (after the CSV, so script 3 sees it as up to date)
+    if write_parquet(consolidated_df, output_parquet):
+        print(f"Saved consolidated table Parquet to {output_parquet}")
 
 def prepare_mapping(df):
     """
     Prepare a mapping from (camera_site, base_filename) to class_name.
     """
-    df['base_filename'] = df['filename'].apply(create_base_filename)
+    df['base_filename'] = strip_suffix_series(df['filename'])
     df_sorted = df.sort_values(['camera_site', 'base_filename', 'prob'], ascending=[True, True, False])
     mapping_df = df_sorted.drop_duplicates(subset=['camera_site', 'base_filename'], keep='first')
     
@@ -329,32 +319,33 @@ def process_animal_directories(service_base_dir, mapping):
     """
     print("\nBreaking out animal folders into species subfolders...")
     service_base = Path(service_base_dir)
-    animal_dirs = [animal_dir for animal_dir in service_base.rglob('animal') if animal_dir.is_dir()]
+    animal_dirs = list(find_named(service_base, 'animal', dirs=True))
     
     if not animal_dirs:
         print("No 'animal' directories found. Ensure the directory structure is correct.")
         return
     
+    # Bucket the mapping by camera site once, rather than filtering it for every site
+    by_site = defaultdict(dict)
+    for (site, base_filename), class_name in mapping.items():
+        by_site[site][base_filename] = class_name
+    
     for animal_dir in tqdm(animal_dirs, desc="Processing animal directories"):
         camera_site = animal_dir.parent.name
         print(f"\nProcessing 'animal' directory for camera_site: {camera_site}")
         
-        relevant_keys = [key for key in mapping if key[0] == camera_site]
-        classes = {mapping[key] for key in relevant_keys}
-        
-        for class_name in classes:
-            class_dir = animal_dir / class_name
-            if not class_dir.exists():
-                class_dir.mkdir(parents=True, exist_ok=True)
+        site_mapping = by_site.get(camera_site, {})
+        for class_dir in {animal_dir / class_name for class_name in site_mapping.values()}:
+            class_dir.mkdir(parents=True, exist_ok=True)
         
         other_object_needed = False
         other_object_dir = None
         
+        # Matches .jpg, .jpeg, .JPG and .JPEG
         for jpg_file in animal_dir.glob("*.[jJ][pP]*[gG]"):
             base_filename = create_base_filename(jpg_file.name)
-            key = (camera_site, base_filename)
-            if key in mapping:
-                class_name = mapping[key]
+            if base_filename in site_mapping:
+                class_name = site_mapping[base_filename]
                 destination_dir = animal_dir / class_name
                 destination_path = destination_dir / jpg_file.name
                 try:
@@ -381,6 +372,7 @@ def main():
     service_directory = config.get("service_directory")
     classified_snips_path = config.get("classified_snips_path")
     output_table = config.get("output_table")
+    max_workers = config.get("max_workers") or os.cpu_count()
     
     if not all([service_directory, classified_snips_path, output_table]):
         print("Configuration file is missing required fields.")
@@ -388,13 +380,13 @@ def main():
     
     print("Phase 1: Creating species-site table...")
     # Step 1: Sanity Check
-    sanity_check_species_breakout(classified_snips_path)
+    species_snips = sanity_check_species_breakout(classified_snips_path)
 
     # Step 2: Create Keypair Table
-    keypair_df = create_randname_classname_table(classified_snips_path)
+    keypair_df = create_randname_classname_table(species_snips)
 
     # Step 3: Create Consolidated Table
-    consolidated_df = create_consolidated_species_table(service_directory)
+    consolidated_df = create_consolidated_species_table(service_directory, max_workers)
     
     # Step 4: Compare and Update Classifications
     consolidated_df = compare_and_update_classifications(consolidated_df, keypair_df)
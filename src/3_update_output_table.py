@@ -1,44 +1,80 @@
-import os, piexif, shutil
+import os, shutil, time
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from datetime import datetime, timedelta
-from PIL import Image
+from datetime import timedelta
 from tqdm import tqdm
-from common import load_config, SanityCheckError
+from common import create_base_filename, find_named, format_timestamps, is_sorted, load_config, strip_suffix_series, walk_files, write_csv, write_parquet, SanityCheckError
+from exif_cache import get_exif
+
+# Text columns held as Arrow-backed strings for C-level compares, hashing and groupby
+STRING_COLUMNS = ('filename', 'camera_site', 'class_name', 'rand_name')
+
+# Small-range integer columns, stored in the narrowest integer dtype their values fit
+INTEGER_COLUMNS = ('class_id', 'expert_updated', 'event', 'count', 'flash_fired')
 
 # Utility functions
 def load_dataframe(output_table_path):
-    """Load the consolidated species table as a pandas DataFrame."""
+    """
+    Load the consolidated species table as a pandas DataFrame.
+    The Parquet copy is preferred unless the CSV has been edited since it was written.
+    """
     csv_path = Path(str(output_table_path) + ".csv")
+    parquet_path = Path(str(output_table_path) + ".parquet")
     pkl_path = Path(str(output_table_path) + ".pkl")
 
-    if csv_path.exists():
-        return pd.read_csv(csv_path)
+    if parquet_path.exists() and (not csv_path.exists()
+                                  or parquet_path.stat().st_mtime >= csv_path.stat().st_mtime):
+        return pd.read_parquet(parquet_path, engine='pyarrow')
+    elif csv_path.exists():
+        return pd.read_csv(csv_path, engine='pyarrow')
     elif pkl_path.exists():
-        return pd.read_pickle(pkl_path)
+        return pd.read_pickle(pkl_path)  # Tables written before the switch to Parquet
     else:
-        raise FileNotFoundError("No valid .csv or .pkl file found for output_table.")
+        raise FileNotFoundError("No valid .parquet, .csv or .pkl file found for output_table.")
+
+def to_arrow_strings(df):
+    """Cast the text columns used in joins and groupbys to the 'string[pyarrow]' dtype."""
+    for col in STRING_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('string[pyarrow]')
+    return df
+
+def downcast_integers(df):
+    """Downcast the integer code columns (e.g. int64 -> int8); columns with missing or non-integer values are left as-is."""
+    for col in INTEGER_COLUMNS:
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
 
 def save_dataframe(df, output_table_path):
-    """Save the updated DataFrame as both CSV and Pickle files."""
+    """Save the updated DataFrame as both CSV and Parquet files."""
     csv_path = output_table_path.with_suffix(".csv")
-    pkl_path = output_table_path.with_suffix(".pkl")
-    df.to_csv(csv_path, index=False)
-    df.to_pickle(pkl_path)
-    print(f"Updated table saved to {csv_path} and {pkl_path}.")
+    parquet_path = output_table_path.with_suffix(".parquet")
+    write_csv(df, csv_path)
+    # Written after the CSV so load_dataframe sees it as up to date
+    if write_parquet(df, parquet_path):
+        print(f"Updated table saved to {csv_path} and {parquet_path}.")
+    else:
+        print(f"Updated table saved to {csv_path}.")
 
-def scan_animal_folders(service_directory):
+def find_animal_dirs(service_directory):
+    """Walk the service tree once and return every camera site's animal folder."""
+    return list(find_named(service_directory, "animal", dirs=True))
+
+def scan_animal_folders(animal_dirs):
     """
-    Return mapping (base_filename, camera_site) -> (path, camera_site, class_name)
+    Return mapping (base_filename, camera_site) -> (path, camera_site, class_name),
+    plus a list of ((base_filename, camera_site), path) for every unknown_animal image
     * Case-insensitive on filenames
     * Deterministic folder order (alphabetical)
     * Aborts with clear message if duplicates exist
     """
     file_mapping = {}
+    unknown_files = []  # all of them, including snips that share a base filename
     dup_records = []  # collect duplicates to report once
 
-    for animal_dir in tqdm(Path(service_directory).rglob("animal"),
-                           desc="Scanning animal folders"):
+    for animal_dir in tqdm(animal_dirs, desc="Scanning animal folders"):
         camera_site = animal_dir.parent.name
 
         # deterministic alphabetical order, case-insensitive
@@ -48,21 +84,22 @@ def scan_animal_folders(service_directory):
                 continue
             class_name = class_folder.name
 
-            for file in class_folder.rglob('*'):
-                if file.suffix.lower() in ('.jpg', '.jpeg'):
-                    base = create_base_filename(file.name).lower()
-                    key = (base, camera_site)
-
-                    # duplicate across species?
-                    if key in file_mapping and file_mapping[key][2] != class_name:
-                        dup_records.append(
-                            (key[0], key[1],
-                            file_mapping[key][2], class_name,
-                            file_mapping[key][0], file)
-                        )
+            for file in walk_files(class_folder, ('.jpg', '.jpeg')):
+                base = create_base_filename(file.name).lower()
+                key = (base, camera_site)
+                if class_name == "unknown_animal":
+                    unknown_files.append((key, file))
+
+                # duplicate across species?
+                if key in file_mapping and file_mapping[key][2] != class_name:
+                    dup_records.append(
+                        (key[0], key[1],
+                        file_mapping[key][2], class_name,
+                        file_mapping[key][0], file)
+                    )
 
-                    # later folder in sorted order overwrites earlier one
-                    file_mapping[key] = (file, camera_site, class_name)
+                # later folder in sorted order overwrites earlier one
+                file_mapping[key] = (file, camera_site, class_name)
 
     if dup_records:
         print("\nERROR: Same image found in multiple species folders:")
@@ -71,42 +108,33 @@ def scan_animal_folders(service_directory):
                   f"'{new_cls}' @ {new_path}")
         raise SanityCheckError("Resolve duplicates before re-running.")
 
-    return file_mapping
+    return file_mapping, unknown_files
 
-def create_base_filename(filename):
+def scan_loose_images(animal_dirs):
     """
-    Strip -n suffix from the filename.
-    Example: 'I__00001-0.JPG' -> 'I__00001.JPG'
+    Return mapping (base_filename, camera_site) -> path for JPEGs left directly in an animal folder,
+    outside any species subfolder (e.g. when moving them into a species folder failed).
     """
-    parts = filename.split('.')
-    if len(parts) < 2:
-        return filename
-    name, ext = '.'.join(parts[:-1]), parts[-1]
-    if '-' in name:
-        return name.rsplit('-', 1)[0] + '.' + ext
-    return filename
-
-def extract_timestamp(filepath):
+    loose_images = {}
+    for animal_dir in animal_dirs:
+        camera_site = animal_dir.parent.name
+        with os.scandir(animal_dir) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(('.jpg', '.jpeg')) and entry.is_file():
+                    loose_images[(create_base_filename(entry.name).lower(), camera_site)] = Path(entry.path)
+    return loose_images
+
+def extract_timestamp(filepath, date_time_orig=None):
     """
-    Extract date_time_orig from EXIF data or fallback to file modification time.
+    Return the EXIF date_time_orig if available, else fallback to file modification time.
     Return formatted timestamp or 'NA' if both are unavailable.
     """
-    try:
-        with Image.open(filepath) as img:
-            exif_data = piexif.load(img.info.get("exif", b""))
-            date_time_orig = exif_data.get("Exif", {}).get(piexif.ExifIFD.DateTimeOriginal, None)
-            
-            if date_time_orig:
-                # Decode and format EXIF date_time_orig
-                return pd.to_datetime(date_time_orig.decode('UTF-8'), format="%Y:%m:%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
-    except Exception as e:
-        # Log or print if needed for debugging
-        print(f"EXIF extraction failed for {filepath}: {e}")
+    if date_time_orig:
+        return date_time_orig
 
     try:
         # Fallback to file modification time
-        modified_time = os.path.getmtime(filepath)
-        return datetime.fromtimestamp(modified_time).strftime("%Y-%m-%d %H:%M:%S")
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(filepath)))
     except Exception as e:
         # Log or print if needed for debugging
         print(f"File modification time fallback failed for {filepath}: {e}")
@@ -117,28 +145,18 @@ def extract_timestamp(filepath):
 def parse_timestamps(reconciled_df):
     """
     Parse mixed-format timestamps, ensure consistency, and reformat as 'DD/MM/YYYY HH:MM:SS'.
+    Adds a working column to reconciled_df in place; callers should use the returned frame.
     """
-    # Make a copy to avoid SettingWithCopyWarning
-    df = reconciled_df.copy()
-    
-    # First attempt: Parse as 'DD/MM/YYYY HH:MM:SS'
-    df['timestamp_parsed'] = pd.to_datetime(
-        df['timestamp'], 
-        format='%d/%m/%Y %H:%M:%S', 
-        errors='coerce'
-    )
+    df = reconciled_df
 
-    # Find rows that need second parsing attempt
-    nat_mask = df['timestamp_parsed'].isna()
-    
-    # Handle alternative format without chained assignment
-    if nat_mask.any():
-        alternative_parsed = pd.to_datetime(
-            df.loc[nat_mask, 'timestamp'],
-            format='%Y-%m-%d %H:%M:%S',
-            errors='coerce'
-        )
-        df.loc[nat_mask, 'timestamp_parsed'] = alternative_parsed
+    # Parse 'DD/MM/YYYY HH:MM:SS' (existing rows), then only the failures as 'YYYY-MM-DD HH:MM:SS' (new rows).
+    # cache=True converts each distinct string once; burst photos share timestamps heavily.
+    parsed = pd.to_datetime(df['timestamp'], format='%d/%m/%Y %H:%M:%S', errors='coerce', cache=True)
+    unparsed = parsed.isna()
+    if unparsed.any():
+        parsed = parsed.fillna(pd.to_datetime(df.loc[unparsed, 'timestamp'], format='%Y-%m-%d %H:%M:%S',
+                                              errors='coerce', cache=True))
+    df['timestamp_parsed'] = parsed
 
     bad = df['timestamp_parsed'].isna().sum()
     if bad:
@@ -147,47 +165,57 @@ def parse_timestamps(reconciled_df):
 
     # Sort by datetime and format consistently
     df = df.sort_values(['camera_site', 'timestamp_parsed'])
-    df['timestamp'] = df['timestamp_parsed'].dt.strftime('%d/%m/%Y %H:%M:%S')
+    df['timestamp'] = format_timestamps(df['timestamp_parsed'])
     df = df.drop(columns=['timestamp_parsed'])
 
     return df
 
-def reconcile_table(df, file_mapping):
-    updated_rows = []
+def reconcile_table(df, file_mapping, exif):
+    """
+    Reconcile the table with the species folders scanned from each \animal folder.
+    Rows are matched to images on (normalized filename, camera_site) with a single merge:
+    * Case 1: matched and unchanged
+    * Case 2: matched to a different species folder, so reclassified (expert_updated = 3)
+    * Case 3: images with no row are appended, except 'other_object' (expert_updated = 4)
+    Only the first row for each image is matched against its folder.
+    """
     df_columns = df.columns.tolist()
-    updates_count = 0  # Counter for updates
-
-    for idx, row in tqdm(df.iterrows(), total=len(df), desc="Reconciling table"):
-        base_filename = create_base_filename(row['filename']).lower()
-        camera_site = row['camera_site']
-
-        if (base_filename, camera_site) in file_mapping:
-            file, mapped_camera_site, class_name = file_mapping[(base_filename, camera_site)]
-            if mapped_camera_site == camera_site:
-                if row['class_name'] == class_name:
-                    updated_rows.append(row.to_dict())
-                else:
-                    # Case 2: Update row
-                    row['class_name'] = class_name
-                    row['class_id'] = (
-                        0 if class_name == "unknown_animal" else (
-                            df[df['class_name'] == class_name]['class_id'].iloc[0]
-                            if class_name in df['class_name'].values
-                            else -1
-                        )
-                    )
-                    row['expert_updated'] = 3        
-                    updated_rows.append(row.to_dict())
-                    updates_count += 1  # Increment counter
-                file_mapping.pop((base_filename, camera_site))
-            else:
-                updated_rows.append(row.to_dict())
-        else:
-            updated_rows.append(row.to_dict())
+    keys = ['_fnorm', 'camera_site']
+
+    # Folder scan as a frame keyed like the table
+    fm_df = pd.DataFrame(
+        [(base_filename, camera_site, class_name, file)
+         for (base_filename, camera_site), (file, _, class_name) in file_mapping.items()],
+        columns=keys + ['_folder_class', '_file'])
+    fm_df['_fnorm'] = fm_df['_fnorm'].astype(df['filename'].dtype)
+    fm_df['camera_site'] = fm_df['camera_site'].astype(df['camera_site'].dtype)
+
+    table = df.assign(_fnorm=strip_suffix_series(df['filename']).str.lower())
+    first_row = ~table.duplicated(keys).to_numpy()
+    merged = table.merge(fm_df, on=keys, how='left', indicator=True)
+
+    # Case 2: Update rows whose image now sits in a different species folder
+    matched = (merged['_merge'] == 'both').to_numpy() & first_row
+    differs = (merged['class_name'] != merged['_folder_class']).fillna(False).to_numpy(dtype=bool)
+    changed = matched & differs
+
+    first_of_class = df.drop_duplicates('class_name')
+    class_ids = dict(zip(first_of_class['class_name'], first_of_class['class_id']))
+    new_classes = merged.loc[changed, '_folder_class']
+    merged.loc[changed, 'class_name'] = new_classes
+    merged.loc[changed, 'class_id'] = np.where(
+        new_classes == "unknown_animal", 0, new_classes.map(class_ids).fillna(-1)).astype(merged['class_id'].dtype)
+    merged.loc[changed, 'expert_updated'] = 3
+    updates_count = int(changed.sum())
+
+    existing_df = merged.drop(columns=['_fnorm', '_folder_class', '_file', '_merge'])
+
+    # Case 3 candidates: scanned images that no table row refers to
+    unmatched = fm_df.merge(table[keys].drop_duplicates(), on=keys, how='left', indicator=True)
+    unmatched = unmatched.loc[unmatched['_merge'] == 'left_only', ['camera_site', '_folder_class', '_file']]
 
     # Count new rows added
-    new_rows_count = sum(1 for (_, _), (_, _, class_name) in file_mapping.items() 
-                        if class_name != "other_object")
+    new_rows_count = int((unmatched['_folder_class'] != "other_object").sum())
 
     print(f"\nReconciliation summary:")
     print(f"  - Updated classifications: {updates_count}")
@@ -195,43 +223,32 @@ def reconcile_table(df, file_mapping):
     print(f"  - Total changes: {updates_count + new_rows_count}\n")
 
     # Case 3: Append new rows for unmapped files, excluding 'other_object'
-    for (base_filename, mapped_camera_site), (file, _, class_name) in file_mapping.items():
-        if class_name == "other_object":
-            continue  # Ignore files in 'other_object'
-
-        timestamp = extract_timestamp(file)
-
-        new_row = {
-            'camera_site': mapped_camera_site,
-            'filename': file.name,
-            'class_id': (
-                0 if class_name == "unknown_animal" else (
-                    df[df['class_name'] == class_name]['class_id'].iloc[0]
-                    if class_name in df['class_name'].values
-                    else -1
-                )    
-            ),
-            'prob': 1,
-            'class_name': class_name,
-            'rand_name': "none",
-            'conf': 0,
-            'expert_updated': 4,
-            'event': 0,
-            'timestamp': timestamp
-        }
-
-        updated_rows.append(new_row)
-
-    # Ensure all rows have consistent keys
-    for row in updated_rows:
+    unmatched = unmatched[unmatched['_folder_class'] != "other_object"]
+    new_cols = {col: [] for col in df_columns}
+    for mapped_camera_site, class_name, file in unmatched.itertuples(index=False, name=None):
+        new_cols['camera_site'].append(mapped_camera_site)
+        new_cols['filename'].append(file.name)
+        new_cols['class_id'].append(0 if class_name == "unknown_animal" else class_ids.get(class_name, -1))
+        new_cols['class_name'].append(class_name)
+        new_cols['timestamp'].append(extract_timestamp(file, exif[file][0]))
+
+    if new_rows_count:
+        # Constant columns for new rows; any other table column is left missing
+        defaults = {'prob': 1, 'rand_name': "none", 'conf': 0, 'expert_updated': 4, 'event': 0}
+        missing_cols = [col for col in df_columns if not new_cols[col] and col not in defaults]
         for col in df_columns:
-            if col not in row:
-                row[col] = "NA"  # Fill missing columns with NA
-        for extra_col in set(row.keys()) - set(df_columns):
-            del row[extra_col]  # Remove unexpected keys
-
-    # Convert updated_rows back to a DataFrame
-    reconciled_df = pd.DataFrame(updated_rows)
+            if not new_cols[col]:
+                new_cols[col] = [defaults.get(col)] * new_rows_count
+        new_df = pd.DataFrame(new_cols, columns=df_columns)
+        for col in missing_cols:
+            # Give the missing values the column's dtype so the concat keeps it; numpy ints and
+            # bools can't hold missing values, so those take the matching nullable dtype
+            dtype = existing_df[col].dtype
+            if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+                dtype = existing_df[col].iloc[:0].convert_dtypes().dtype
+            new_df[col] = new_df[col].astype(dtype)
+        existing_df = pd.concat([existing_df, new_df], ignore_index=True)
+    reconciled_df = downcast_integers(to_arrow_strings(existing_df))
     reconciled_df = parse_timestamps(reconciled_df)
     reconciled_df.reset_index(drop=True, inplace=True)
 
@@ -250,13 +267,13 @@ def recalc_events_and_infer_unknowns(reconciled_df, int_m=5, thresh=0.2):
     - pd.DataFrame: Updated DataFrame with recalculated events and inferred unknowns.
     """
     print("Recalculating events and refining unknown_animal classifications...")
-    inferred_count = 0  # Counter for inferred unknowns
 
     # Ensure 'timestamp' is datetime with dayfirst=True to avoid warnings
     reconciled_df['timestamp'] = pd.to_datetime(reconciled_df['timestamp'], dayfirst=True, errors='coerce')
     
-    # Sort by camera_site and timestamp
-    reconciled_df.sort_values(['camera_site', 'timestamp'], inplace=True)
+    # Sort by camera_site and timestamp (usually already in this order from parse_timestamps)
+    if not is_sorted(reconciled_df, ['camera_site', 'timestamp']):
+        reconciled_df.sort_values(['camera_site', 'timestamp'], inplace=True)
     reconciled_df.reset_index(drop=True, inplace=True)
 
     # Recalculate events
@@ -265,30 +282,36 @@ def recalc_events_and_infer_unknowns(reconciled_df, int_m=5, thresh=0.2):
     reconciled_df['event'] = reconciled_df.groupby('camera_site')['new_event'].cumsum() + 1
 
     # Refine unknown_animal classifications within events
-    grouped = reconciled_df.groupby(['camera_site', 'event'])
-    for (camera_site, event), group in tqdm(grouped, desc="Processing events"):
-        valid_species = group[(group['class_name'] != 'unknown_animal') & (group['prob'] >= thresh)]
-        
-        if not valid_species.empty:
-            replacement_class = valid_species['class_name'].mode()[0]
-            replacement_prob = valid_species['prob'].max()
-
-            unknown_indices = group[group['class_name'] == 'unknown_animal'].index
-            if len(unknown_indices) > 0:
-                inferred_count += len(unknown_indices)
-                reconciled_df.loc[unknown_indices, 'class_name'] = replacement_class
-                reconciled_df.loc[unknown_indices, 'prob'] = replacement_prob
-                reconciled_df.loc[unknown_indices, 'expert_updated'] = 5
+    event_keys = ['camera_site', 'event']
+    valid = ((reconciled_df['class_name'] != 'unknown_animal') & (reconciled_df['prob'] >= thresh)).fillna(False)
+
+    # Most frequent valid species per event (ties go to the first name in sort order, as Series.mode)
+    species_counts = (reconciled_df.loc[valid, event_keys + ['class_name']]
+                      .groupby(event_keys + ['class_name']).size().reset_index(name='n'))
+    replacement_classes = (species_counts.sort_values(['n', 'class_name'], ascending=[False, True])
+                           .drop_duplicates(event_keys)[event_keys + ['class_name']])
+    replacement_class = reconciled_df[event_keys].merge(
+        replacement_classes, on=event_keys, how='left')['class_name'].to_numpy()
+    # Highest valid probability per event; NaN where an event has no valid species
+    replacement_prob = reconciled_df['prob'].where(valid).groupby(
+        [reconciled_df['camera_site'], reconciled_df['event']]).transform('max')
+
+    unknown_mask = ((reconciled_df['class_name'] == 'unknown_animal').fillna(False)
+                    & replacement_prob.notna()).to_numpy()
+    inferred_count = int(unknown_mask.sum())
+    reconciled_df.loc[unknown_mask, 'class_name'] = replacement_class[unknown_mask]
+    reconciled_df.loc[unknown_mask, 'prob'] = replacement_prob[unknown_mask]
+    reconciled_df.loc[unknown_mask, 'expert_updated'] = 5
 
     print(f"\nEvent processing summary:")
-    print(f"  - Total events processed: {len(grouped)}")
+    print(f"  - Total events processed: {reconciled_df.groupby(event_keys).ngroups}")
     print(f"  - Unknown animals inferred: {inferred_count}\n")
 
     # Clean up intermediate columns
     reconciled_df.drop(columns=['time_diff', 'new_event'], inplace=True)
 
     # Format all timestamps as 'DD/MM/YYYY HH:MM:SS'
-    reconciled_df['timestamp'] = reconciled_df['timestamp'].dt.strftime('%d/%m/%Y %H:%M:%S')
+    reconciled_df['timestamp'] = format_timestamps(reconciled_df['timestamp'])
 
     print("Event recalculation and refinement completed.")
     return reconciled_df
@@ -299,56 +322,31 @@ def count_animals_per_event(df):
     """
     GROUP_COLS = ['camera_site', 'class_name', 'event', 'timestamp']
     
-    df = df.copy() # Make a copy to avoid modifying original
-    
     # Drop count column if it already exists
     if 'count' in df.columns:
         df = df.drop(columns=['count'])
     
-    # Insert count column after class_name
-    df.insert(df.columns.get_loc('class_name') + 1, 'count', 1)
-    
-    # Process each camera site
-    all_camera_sites = df['camera_site'].unique()
-    
-    for site in tqdm(all_camera_sites, desc="Processing camera sites to count animals on each image..."):
-        # Get data for this site
-        site_mask = df['camera_site'] == site
-        
-        # Group and count duplicates using GROUP_COLS
-        counts = df[site_mask].groupby(GROUP_COLS).size()
-        
-        # Find first occurrence of each timestamp group
-        duplicates = df[site_mask].duplicated(GROUP_COLS, keep='first')
-        
-        # Get indices of rows to update
-        update_idx = df[site_mask & ~duplicates].index
-        
-        # Update counts directly using index alignment
-        for idx in update_idx:
-            key = tuple(df.loc[idx, GROUP_COLS])
-            df.loc[idx, 'count'] = counts[key]
+    # Size of each timestamp group, broadcast back to its rows
+    counts = df.groupby(GROUP_COLS, dropna=False, sort=False)['filename'].transform('size')
     
-    # Remove duplicate rows
-    result = df[~df.duplicated(GROUP_COLS)].copy()
+    # Keep the first row of each group, with its count inserted after class_name
+    first = ~df.duplicated(GROUP_COLS, keep='first')
+    result = df[first].copy()
+    result.insert(result.columns.get_loc('class_name') + 1, 'count', counts[first].astype('int32'))
     
-    # Final sanity check - align indices before comparing
-    original_counts = df.groupby(GROUP_COLS).size()
-    result_counts = result.set_index(GROUP_COLS)['count']    
-    # Reindex both Series to have the same index
-    common_index = original_counts.index.intersection(result_counts.index)
-    original_aligned = original_counts[common_index]
-    result_aligned = result_counts[common_index]
-    
-    mismatches = (original_aligned != result_aligned).sum()
+    # Final sanity check - compare against an independent count of rows per group
+    original_counts, result_counts = (
+        df.groupby(GROUP_COLS, dropna=False).size()
+        .align(result.groupby(GROUP_COLS, dropna=False)['count'].sum(), join='outer', fill_value=0)
+    )
+    mismatch_idx = original_counts != result_counts
     
-    if mismatches > 0:
-        print(f"\nWARNING: Found {mismatches} count mismatches in final verification, aborting script.")
+    if mismatch_idx.any():
+        print(f"\nWARNING: Found {mismatch_idx.sum()} count mismatches in final verification, aborting script.")
         print("Original counts vs Result counts:")
-        mismatch_idx = original_aligned != result_aligned
         print(pd.DataFrame({
-            'Original': original_aligned[mismatch_idx],
-            'Result': result_aligned[mismatch_idx]
+            'Original': original_counts[mismatch_idx],
+            'Result': result_counts[mismatch_idx]
         }))
         raise SanityCheckError()
     
@@ -358,153 +356,88 @@ def count_animals_per_event(df):
     
     return result
 
-def extract_flash_fired(filepath):
-    """
-    Extract whether the flash fired from EXIF data of the image.
-    Return 1 if flash fired, 0 otherwise.
-    """
-    try:
-        exif_data = piexif.load(str(filepath))
-        if 37385 in exif_data["Exif"]:
-            flash_status = exif_data["Exif"][37385]
-            return 1 if flash_status != 0 else 0
-    except Exception as e:
-        print(f"Error reading EXIF from {filepath}: {e}")
-    return 0  # Default to no flash
-
-def create_base_filename(filename):
-    """
-    Strip -n suffix from the filename.
-    Example: 'I__00001-0.JPG' -> 'I__00001.JPG'
-    """
-    parts = filename.split('.')
-    if len(parts) < 2:
-        return filename
-    name, ext = '.'.join(parts[:-1]), parts[-1]
-    if '-' in name:
-        return name.rsplit('-', 1)[0] + '.' + ext
-    return filename
-
-def update_flash_fired(service_directory, df):
+def update_flash_fired(file_mapping, exif, df, loose_images=None):
     """
     Update the DataFrame with a 'flash_fired' column for all images in \animal folders.
     
     Parameters:
-    - service_directory: Path to the service directory
+    - file_mapping: Mapping (base_filename, camera_site) -> (path, camera_site, class_name)
+      from scan_animal_folders, so the service tree is not walked a second time
+    - exif: Mapping path -> (date_time_orig, flash_fired) from exif_cache.get_exif
     - df: DataFrame to update (already in memory)
+    - loose_images: Mapping (base_filename, camera_site) -> path from scan_loose_images,
+      for images left directly in an animal folder; species-folder images take precedence
     
     Returns:
     - Updated DataFrame with flash_fired column
     """
     print("Updating flash_fired data...")
-    
-    # Initialize flash_fired column
-    df['flash_fired'] = -1  # Default to -1 for rows not matched to any image
-    
-    if '_fnorm' not in df.columns:
-        df['_fnorm'] = df['filename'].apply(lambda x: create_base_filename(x).lower())
-
-    # Iterate over camera sites
-    service_path = Path(service_directory)
-    animal_dirs = service_path.rglob("animal")
-
-    for animal_dir in tqdm(animal_dirs, desc="Processing animal folders"):
-        camera_site = animal_dir.parent.name  # Extract camera_site from folder structure
-
-        for image_path in animal_dir.rglob('*'):
-            if not image_path.is_file():
-                continue
-            if image_path.suffix.lower() not in ('.jpg', '.jpeg'):
-                continue
 
-            base_filename = create_base_filename(image_path.name).lower()
-            flash_value   = extract_flash_fired(image_path)
+    images = dict(loose_images or {})
+    images.update({key: path for key, (path, _, _) in file_mapping.items()})
 
-            mask = (
-                (df['_fnorm'] == base_filename) &
-                (df['camera_site'] == camera_site)
-            )
+    # Flash value per scanned image, indexed like file_mapping: (base_filename, camera_site)
+    flash = pd.Series(
+        [exif[path][1] for path in images.values()],
+        index=pd.MultiIndex.from_tuples(list(images.keys()), names=['_fnorm', 'camera_site']),
+        dtype='int8'
+    )
+    row_keys = pd.MultiIndex.from_arrays([
+        strip_suffix_series(df['filename']).str.lower().astype(object),
+        df['camera_site'].astype(object)
+    ])
 
-            df.loc[mask, 'flash_fired'] = flash_value
+    # Rows not matched to any image get -1
+    df['flash_fired'] = flash.reindex(row_keys).fillna(-1).astype('int8').to_numpy()
 
     print("Flash data updated for all matching rows.")
-    df.drop(columns='_fnorm', inplace=True)
 
     return df
 
-def move_inferred_unknowns(service_directory, df):
+def move_inferred_unknowns(unknown_files, df):
     """
     Move files out of the unknown_animal folder if their updated class_name
-    in the dataframe is not unknown_animal, with a tqdm progress bar by camera site.
+    in the dataframe is not unknown_animal, with a tqdm progress bar.
 
     Parameters:
-    - service_directory: Path to the service directory
+    - unknown_files: List of ((base_filename, camera_site), path) from scan_animal_folders,
+      covering every file in the unknown_animal folders
     - df: DataFrame containing updated classifications (already in memory)
 
     Returns:
     - None; files are moved in the filesystem.
     """
+    # First matching row's class_name for each (normalized filename, camera_site)
+    fnorm = strip_suffix_series(df['filename']).str.lower()
+    final_classes = (
+        pd.DataFrame({'_fnorm': fnorm, 'camera_site': df['camera_site'], 'class_name': df['class_name']})
+        .drop_duplicates(subset=['_fnorm', 'camera_site'], keep='first')
+    )
+    final_class_map = dict(zip(
+        zip(final_classes['_fnorm'], final_classes['camera_site']),
+        final_classes['class_name']
+    ))
 
-    service_path = Path(service_directory)
+    print("Checking inferred unknown_animal images to move them to correct folders...")
 
-    # Recursively find all "unknown_animal" directories
-    unknown_dirs = list(service_path.rglob("unknown_animal"))
+    for key, image_file in tqdm(unknown_files, desc="Moving inferred unknowns"):
+        # If no matching row in df, skip
+        final_class = final_class_map.get(key)
+        if final_class is None:
+            continue
 
-    # Collect all camera sites that actually have an unknown_animal folder
-    camera_sites = sorted(
-        {
-            unknown_dir.parent.parent.name  # e.g., camera_site
-            for unknown_dir in unknown_dirs
-            if unknown_dir.parent.name == "animal"
-        }
-    )
+        # If final_class differs from 'unknown_animal', move the file
+        if final_class != "unknown_animal":
+            animal_dir = next(p.parent for p in image_file.parents if p.name == "unknown_animal")
+            dest_folder = animal_dir / final_class
+            dest_folder.mkdir(parents=True, exist_ok=True)
 
-    print("Checking inferred unknown_animal images to move them to correct folders...")
+            dest_path = dest_folder / image_file.name
 
-    # Iterate over camera sites in a tqdm progress bar
-    for camera_site in tqdm(camera_sites, desc="Moving inferred unknowns by site"):
-        # Filter unknown_animal dirs corresponding to this camera_site
-        site_unknown_dirs = [
-            ud for ud in unknown_dirs if ud.parent.parent.name == camera_site
-        ]
-
-        # For each unknown_animal folder in this camera_site
-        for unknown_dir in site_unknown_dirs:
-            # Find JPG files in this unknown_animal folder
-            for image_file in unknown_dir.rglob('*'):
-                if not image_file.is_file():
-                    continue
-                if image_file.suffix.lower() not in ('.jpg', '.jpeg'):
-                    continue
-
-                # Normalize the local filename for matching
-                folder_base_fname = create_base_filename(image_file.name).lower()
-
-                # Match rows in df by camera_site and normalized filename
-                mask = (
-                    (df['camera_site'] == camera_site) &
-                    (df['filename'].apply(lambda x: create_base_filename(x).lower())
-                        == create_base_filename(image_file.name).lower())
-                )
-
-                # If no matching row in df, skip
-                if not mask.any():
-                    continue
-
-                # Grab the first matching row's class_name
-                final_class = df.loc[mask, "class_name"].iloc[0]
-
-                # If final_class differs from 'unknown_animal', move the file
-                if final_class != "unknown_animal":
-                    dest_folder = service_path / camera_site / "animal" / final_class
-                    dest_folder.mkdir(parents=True, exist_ok=True)
-
-                    dest_path = dest_folder / image_file.name
-
-                    try:
-                        shutil.move(str(image_file), str(dest_path))
-                    except Exception as e:
-                        print(f"Error moving {image_file} to {dest_path}: {e}")
+            try:
+                shutil.move(str(image_file), str(dest_path))
+            except Exception as e:
+                print(f"Error moving {image_file} to {dest_path}: {e}")
 
     print("All inferred unknown_animal files have been processed.")
 
@@ -514,6 +447,7 @@ def main():
 
     service_directory = config.get('service_directory')
     output_table_path = Path(config.get('output_table'))
+    max_workers = config.get('max_workers') or os.cpu_count()
 
     if not service_directory or not output_table_path:
         print("Configuration file is missing required fields: 'service_directory' and/or 'output_table'.")
@@ -522,13 +456,19 @@ def main():
     print("\nUpdating output table...")
     # 1 ─ load config / table
     df = load_dataframe(output_table_path)
+    df = downcast_integers(to_arrow_strings(df))
 
     # 2 ─ scan folders, reconcile table   (class_name, expert_updated)
-    file_mapping   = scan_animal_folders(service_directory)
-    reconciled_df  = reconcile_table(df, file_mapping)
+    animal_dirs    = find_animal_dirs(service_directory)
+    file_mapping, unknown_files = scan_animal_folders(animal_dirs)
+    loose_images   = scan_loose_images(animal_dirs)
+    image_paths    = [path for path, _, _ in file_mapping.values()] + list(loose_images.values())
+    exif_df        = get_exif(image_paths, config.get('exif_cache'), max_workers, roots=animal_dirs)
+    exif           = dict(zip(image_paths, zip(exif_df['date_time_orig'], exif_df['flash_fired'])))
+    reconciled_df  = reconcile_table(df, file_mapping, exif)
 
-    # 3 ─ update EXIF flash *before* events
-    reconciled_df  = update_flash_fired(service_directory, reconciled_df)
+    # 3 ─ update EXIF flash *before* events, reusing the folder scan
+    reconciled_df  = update_flash_fired(file_mapping, exif, reconciled_df, loose_images)
 
     #3a ─ prune rows whose images are gone
     orphans = reconciled_df[reconciled_df['flash_fired'] == -1]
@@ -549,7 +489,7 @@ def main():
     reconciled_df  = count_animals_per_event(reconciled_df)
 
     # 6 ─ move inferred unknowns, then save
-    move_inferred_unknowns(service_directory, reconciled_df)
+    move_inferred_unknowns(unknown_files, reconciled_df)
 
     save_dataframe(reconciled_df, output_table_path)
 
@@ -1,10 +1,11 @@
-import piexif
+import os
 import pandas as pd
 from pathlib import Path
-from datetime import datetime
-from collections import defaultdict
 from tqdm import tqdm
-from common import load_config, SanityCheckError
+from common import find_named, format_timestamps, load_config, walk_files, write_csv, SanityCheckError
+from exif_cache import get_exif
+
+IMAGE_CATEGORIES = ['animal', 'blank', 'person', 'vehicle']
 
 def load_site_table(site_table_path):
     """Load the site table CSV and verify required columns."""
@@ -25,7 +26,7 @@ def get_site_directories(service_directory):
     site_dirs = {}
     
     # Walk through all subdirectories
-    for path in service_path.rglob('md_out.json'):
+    for path in find_named(service_path, 'md_out.json'):
         # Parent directory of md_out.json is the site directory
         site_dir = path.parent
         site_name = site_dir.name
@@ -59,92 +60,81 @@ def perform_sanity_checks(site_table, site_dirs):
 
 def get_image_files(site_dir):
     """Recursively get all image files under a site directory."""
-    image_extensions = {'.jpg', '.jpeg', '.png'}
-    return [f for f in site_dir.rglob('*') if f.is_file() and f.suffix.lower() in image_extensions]
-
-def extract_image_info(image_files):
-    """Extract timestamps and categorize images."""
-    first_timestamp = None
-    last_timestamp = None
-    timestamps = []
-    animal_dates = set()
-    event_dates = set()
-    counts = defaultdict(int)
-
-    for img_file in image_files:
-        # Check if file is in any subfolder under 'animal'
-        is_animal = 'animal' in img_file.parent.parts
-        # For other categories, check immediate parent folder
-        category = img_file.parent.name.lower()
-        
-        # Categorize the image
-        if is_animal:
-            category = 'animal'
-        elif category not in ['blank', 'person', 'vehicle']:
-            continue  # Skip irrelevant folders
-            
-        counts[category] += 1
-
-        # Extract timestamp using piexif
-        try:
-            exif_data = piexif.load(str(img_file))
-            date_time_orig = exif_data.get("Exif", {}).get(piexif.ExifIFD.DateTimeOriginal, None)
-            if date_time_orig:
-                timestamp = datetime.strptime(date_time_orig.decode('utf-8'), "%Y:%m:%d %H:%M:%S")
-            else:
-                timestamp = None
-        except Exception:
-            timestamp = None
-
-        if timestamp:
-            timestamps.append(timestamp)
-            if not first_timestamp or timestamp < first_timestamp:
-                first_timestamp = timestamp
-            if not last_timestamp or timestamp > last_timestamp:
-                last_timestamp = timestamp
-
-            # Track dates for animal and event images
-            date_str = timestamp.strftime('%Y-%m-%d')
-            if category == 'animal':
-                animal_dates.add(date_str)
-            event_dates.add(date_str)
-
-    return {
-        'first_image': first_timestamp.strftime('%d/%m/%Y %H:%M:%S') if first_timestamp else None,
-        'last_image': last_timestamp.strftime('%d/%m/%Y %H:%M:%S') if last_timestamp else None,
-        'op_days': (last_timestamp - first_timestamp).days if first_timestamp and last_timestamp else None,
+    return list(walk_files(site_dir, ('.jpg', '.jpeg', '.png')))
+
+def categorize_image(img_file):
+    """Return 'animal', 'blank', 'person' or 'vehicle' for an image, or None for irrelevant folders."""
+    # Check if file is in any subfolder under 'animal'
+    if 'animal' in img_file.parent.parts:
+        return 'animal'
+    # For other categories, check immediate parent folder
+    category = img_file.parent.name.lower()
+    return category if category in IMAGE_CATEGORIES else None
+
+def summarize_sites(images, site_names):
+    """
+    Compute the site table statistics from one frame of images with columns
+    camera_site, category and timestamp (NaT where no EXIF date is available).
+    Sites without any images get zero counts and empty timestamps.
+    """
+    sites = pd.Index(site_names, name='camera_site')
+    images = images.assign(day=images['timestamp'].dt.normalize())
+    by_site = images.groupby('camera_site')
+
+    counts = (images.groupby(['camera_site', 'category']).size()
+              .unstack(fill_value=0)
+              .reindex(index=sites, columns=IMAGE_CATEGORIES, fill_value=0))
+    first_timestamp = by_site['timestamp'].min().reindex(sites)
+    last_timestamp = by_site['timestamp'].max().reindex(sites)
+    animal_days = images[images['category'] == 'animal'].groupby('camera_site')['day'].nunique()
+
+    stats = pd.DataFrame({
+        'first_image': format_timestamps(first_timestamp),
+        'last_image': format_timestamps(last_timestamp),
+        'op_days': (last_timestamp - first_timestamp).dt.days,
         'animal': counts['animal'],
-        'days_with_animal': len(animal_dates),
+        'days_with_animal': animal_days.reindex(sites, fill_value=0),
         'blank': counts['blank'],
         'person': counts['person'],
         'vehicle': counts['vehicle'],
-        'total_images': sum(counts.values()),
-        'days_with_event': len(event_dates),
-    }
-
-def update_site_table(site_table, site_dirs):
-    """Update the site table with new columns."""
-    new_columns = ['first_image', 'last_image', 'op_days', 'animal', 'days_with_animal',
-                   'blank', 'person', 'vehicle', 'total_images', 'days_with_event']
-    for col in new_columns:
-        site_table[col] = None  # Initialize new columns
-
-    for index, row in tqdm(site_table.iterrows(), total=site_table.shape[0], desc="Processing sites"):
-        site_name = row['camera_site']
-        site_dir = site_dirs.get(site_name)
-        if not site_dir:
-            print(f"Skipping site '{site_name}' as it is missing in service directory.")
-            continue
-        image_files = get_image_files(site_dir)
-        image_info = extract_image_info(image_files)
-        for col in new_columns:
-            site_table.at[index, col] = image_info[col]
-    return site_table
+        'total_images': counts.sum(axis=1),
+        'days_with_event': by_site['day'].nunique().reindex(sites, fill_value=0),
+    }, index=sites)
+    return stats.reset_index()
+
+def update_site_table(site_table, site_dirs, exif_cache=None, max_workers=None):
+    """
+    Update the site table with new columns. EXIF for every relevant image is read once
+    through the shared EXIF cache, in parallel worker processes.
+    """
+    image_sites, image_categories, all_images = [], [], []
+    for site_name, site_dir in tqdm(site_dirs.items(), desc="Listing site images"):
+        for img_file in get_image_files(site_dir):
+            category = categorize_image(img_file)
+            if category is None:
+                continue  # Skip irrelevant folders
+            image_sites.append(site_name)
+            image_categories.append(category)
+            all_images.append(img_file)
+
+    exif_df = get_exif(all_images, exif_cache, max_workers, roots=site_dirs.values())
+    images = pd.DataFrame({
+        'camera_site': image_sites,
+        'category': image_categories,
+        'timestamp': pd.to_datetime(exif_df['date_time_orig'], format='%Y-%m-%d %H:%M:%S',
+                                    errors='coerce', cache=True).to_numpy(),
+    })
+    stats_df = summarize_sites(images, list(site_dirs))
+
+    # Replace stats left by a previous run rather than suffixing duplicates
+    site_table = site_table.drop(columns=stats_df.columns.drop('camera_site'), errors='ignore')
+    return site_table.merge(stats_df, on='camera_site', how='left')
 
 def main():
     config = load_config()
     service_directory = config.get('service_directory')
     site_table_path = config.get('site_table')
+    max_workers = config.get('max_workers') or os.cpu_count()
 
     if not service_directory or not site_table_path:
         print("Error: 'service_directory' and/or 'site_table' is missing in configuration.")
@@ -161,10 +151,10 @@ def main():
     perform_sanity_checks(site_table, site_dirs)
 
     # Update site table with new columns
-    updated_site_table = update_site_table(site_table, site_dirs)
+    updated_site_table = update_site_table(site_table, site_dirs, config.get('exif_cache'), max_workers)
 
     # Save updated site table
-    updated_site_table.to_csv(site_table_path, index=False)
+    write_csv(updated_site_table, site_table_path)
     print("Site table has been updated and saved.")
 
 if __name__ == "__main__":
@@ -1,26 +1,39 @@
-import os, subprocess, sys, yaml
+import copy, exifread, functools, io, os, re, subprocess, sys, yaml
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
 from dotenv import load_dotenv
 from pathlib import Path
 
+# Snip suffix to strip: the last '-...' of the name before the extension, e.g. 'I__00001-0.JPG'
+BASE_FILENAME_PATTERN = r'-[^-]*(\.[^.]*)$'
+_STRIP_RE = re.compile(BASE_FILENAME_PATTERN)
+
+# Camera-trap JPEGs keep EXIF in the APP1 segment (at most 64 KB) at the head of the file
+EXIF_HEADER_BYTES = 128 * 1024
+
 class SanityCheckError(Exception):
     """Custom exception for sanity check failures."""
     pass
 
+# Use libyaml's C loader when pyyaml was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 # Load .env file if present
 load_dotenv()
 
-def load_config():
-    """Load configuration parameters from params.yaml, with environment variable overrides."""
-    script_dir = Path(__file__).resolve().parent
-    config_path = script_dir / 'params.yaml'
-
+@functools.lru_cache(maxsize=1)
+def read_params(config_path):
+    """Parse params.yaml once per process."""
     if not config_path.is_file():
         print(f"Configuration file '{config_path}' does not exist.")
         sys.exit(1)
 
     try:
         with open(config_path, 'r') as f:
-            params = yaml.safe_load(f)
+            return yaml.load(f, Loader=YAML_LOADER)
     except yaml.YAMLError as e:
         print(f"Error parsing YAML file '{config_path}': {e}")
         sys.exit(1)
@@ -28,6 +41,12 @@ def load_config():
         print(f"Unexpected error reading '{config_path}': {e}")
         sys.exit(1)
 
+def load_config():
+    """Load configuration parameters from params.yaml, with environment variable overrides."""
+    script_dir = Path(__file__).resolve().parent
+    # Copy so callers can't modify the cached parse
+    params = copy.deepcopy(read_params(script_dir / 'params.yaml'))
+
     for key in params.keys():
         env_var = os.getenv(key.upper())
         if env_var is not None:
@@ -44,6 +63,124 @@ def load_config():
 
     return params
 
+def create_base_filename(filename):
+    """
+    Strip -n suffix from the filename.
+    Example: 'I__00001-0.JPG' -> 'I__00001.JPG'
+    """
+    return _STRIP_RE.sub(r'\1', filename)
+
+def strip_suffix_series(filenames):
+    """Vectorized create_base_filename over a Series of filenames."""
+    return filenames.str.replace(BASE_FILENAME_PATTERN, r'\1', regex=True)
+
+def is_sorted(df, keys):
+    """
+    Return True if df is already in ascending lexicographic order of the key columns, in one O(N) pass.
+    Frames with missing key values return False so callers still sort them (sort_values puts them last).
+    """
+    if len(df) < 2:
+        return True
+    ties = np.ones(len(df) - 1, dtype=bool)  # Rows whose earlier keys equal the previous row's
+    for key in keys:
+        values = df[key]
+        if values.isna().any():
+            return False
+        values = values.to_numpy()
+        current, previous = values[1:], values[:-1]
+        if (ties & (current < previous)).any():
+            return False
+        ties &= current == previous
+    return True
+
+def walk_files(root, suffixes):
+    """
+    Recursively yield Paths of files under root whose suffix (case-insensitive) is in suffixes.
+    Uses os.scandir, whose entries carry their file type from the directory read, so no extra stat per entry.
+    """
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(suffixes) and entry.is_file():
+                        yield Path(entry.path)
+        except OSError:
+            continue  # Missing or unreadable directory: skip it, as Path.rglob did
+
+def find_named(root, name, dirs=False):
+    """
+    Recursively yield Paths under root named exactly name: files by default, directories if dirs=True.
+    Walks with os.scandir like walk_files.
+    """
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if is_dir:
+                        stack.append(entry.path)
+                    if entry.name == name and (is_dir if dirs else entry.is_file()):
+                        yield Path(entry.path)
+        except OSError:
+            continue  # Missing or unreadable directory: skip it, as Path.rglob did
+
+def read_exif_tags(filepath, stop_tag):
+    """
+    Read EXIF tags from the head of an image, stopping once stop_tag has been parsed.
+    Only the first EXIF_HEADER_BYTES are read from disk; MakerNotes and thumbnails are skipped.
+    """
+    with open(filepath, 'rb') as fh:
+        header = fh.read(EXIF_HEADER_BYTES)
+    return exifread.process_file(io.BytesIO(header), details=False, stop_tag=stop_tag)
+
+def format_timestamps(timestamps, fmt='%d/%m/%Y %H:%M:%S'):
+    """
+    Format a datetime Series as strings with Arrow's C++ strftime (whole seconds, like dt.strftime's %S).
+    Missing timestamps become None.
+    """
+    seconds = pa.array(timestamps).cast(pa.timestamp('s'), safe=False)
+    return pd.Series(pc.strftime(seconds, format=fmt).to_numpy(zero_copy_only=False),
+                     index=timestamps.index, name=timestamps.name)
+
+def write_parquet(df, path):
+    """
+    Write a DataFrame to zstd-compressed Parquet (without the index).
+    If Arrow can't type a column (e.g. 'NA' strings in a numeric column), warn and remove
+    any stale file at path, so readers fall back to the CSV; returns False in that case.
+    """
+    try:
+        df.to_parquet(path, engine='pyarrow', compression='zstd', index=False)
+        return True
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        print(f"Warning: could not write Parquet file '{path}': {e}. Only the CSV was saved.")
+        Path(path).unlink(missing_ok=True)
+        return False
+
+def write_csv(df, path):
+    """
+    Write a DataFrame to CSV (without the index) using pyarrow's C++ writer.
+    Falls back to pandas for columns Arrow can't type, such as mixed object columns.
+    Datetimes and booleans are written in pandas' text form; unlike to_csv, the header, text and
+    boolean values are always quoted and whole-number floats have no trailing '.0'.
+    """
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df.to_csv(path, index=False)
+        return
+    for i, field in enumerate(table.schema):
+        # Write datetimes as 'YYYY-MM-DD HH:MM:SS', as pandas does, rather than with nanosecond fractions
+        if pa.types.is_timestamp(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.timestamp('s', field.type.tz), safe=False))
+        # Write booleans as pandas' True/False rather than Arrow's true/false
+        elif pa.types.is_boolean(field.type):
+            table = table.set_column(i, field.name, pc.if_else(table.column(i), 'True', 'False'))
+    pa_csv.write_csv(table, str(path), write_options=pa_csv.WriteOptions(quoting_style='needed'))
+
 # Map script numbers to filenames and descriptions
 SCRIPT_MAP = {
     "1": ("1_breakout_snips.py", "Breakout snips into AI-predicted species bins with probability classes, for expert checking and re-arrangement. (Must have already run the MEWC-service workflow on the folders.)\n"),
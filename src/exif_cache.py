@@ -0,0 +1,127 @@
+import os
+import pandas as pd
+from datetime import datetime
+from multiprocessing import Pool
+from pathlib import Path
+from tqdm import tqdm
+from common import read_exif_tags
+
+CACHE_DTYPES = {'path': 'object', 'mtime': 'int64', 'size': 'int64',
+                'date_time_orig': 'object', 'flash_fired': 'int8'}
+CACHE_COLUMNS = list(CACHE_DTYPES)
+# Bump when read_exif changes what it extracts, so entries parsed by older logic are re-read
+CACHE_VERSION = 1
+# Images handed to each worker at a time; fewer misses than this are parsed in-process
+EXIF_CHUNKSIZE = 64
+
+def empty_cache():
+    """Return an empty EXIF cache frame with the cache dtypes."""
+    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in CACHE_DTYPES.items()})
+
+def read_exif(filepath):
+    """
+    Decode the EXIF block of an image once and return (date_time_orig, flash_fired, ok).
+    date_time_orig is formatted 'YYYY-MM-DD HH:MM:SS', or None if unavailable.
+    flash_fired is 1 if the flash fired, 0 otherwise.
+    ok is False if the file could not be read or parsed, so the result is not cached.
+    """
+    date_time_orig, flash_fired = None, 0  # Default to no timestamp and no flash
+    try:
+        # Flash follows DateTimeOriginal in the EXIF IFD, so stop parsing there and skip MakerNotes
+        tags = read_exif_tags(filepath, stop_tag='Flash')
+        flash = tags.get('EXIF Flash')
+        if flash is not None and flash.values:
+            flash_fired = 1 if flash.values[0] != 0 else 0
+        raw_date_time = tags.get('EXIF DateTimeOriginal')
+        if raw_date_time:
+            date_time_orig = datetime.strptime(
+                str(raw_date_time).strip(), "%Y:%m:%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+    except Exception as e:
+        print(f"Error reading EXIF from {filepath}: {e}")
+        return date_time_orig, flash_fired, False
+    return date_time_orig, flash_fired, True
+
+def read_exif_entry(path):
+    """Worker wrapper for read_exif that returns (path, date_time_orig, flash_fired, ok)."""
+    return (path, *read_exif(path))
+
+def load_cache(cache_path):
+    """
+    Load the EXIF cache, or return an empty one if it is missing or unreadable.
+    Entries written with a different CACHE_VERSION are discarded.
+    """
+    if cache_path and Path(cache_path).is_file():
+        try:
+            cache = pd.read_parquet(cache_path)
+            if 'version' not in cache.columns:
+                return empty_cache()
+            current = cache['version'] == CACHE_VERSION
+            return cache.loc[current, CACHE_COLUMNS].astype(CACHE_DTYPES).reset_index(drop=True)
+        except Exception as e:
+            print(f"Warning: could not read EXIF cache '{cache_path}': {e}. Rebuilding it.")
+    return empty_cache()
+
+def get_exif(paths, cache_path=None, max_workers=None, roots=()):
+    """
+    Return EXIF data for the given images as a DataFrame with columns
+    path, mtime, size, date_time_orig, flash_fired, in the same order as paths
+    (an image listed more than once is read once and repeated).
+
+    Images whose (path, mtime, size) match the cache at cache_path are not re-read;
+    the rest are parsed (in worker processes when there are many) and the cache is rewritten.
+    Images that failed to parse are returned with defaults but not cached, so they are retried.
+    Cached images under any of the scanned roots that are not in paths (moved or
+    deleted since) are dropped from the cache; entries elsewhere are kept.
+    Pass cache_path=None to parse everything without persisting.
+    """
+    path_strs = [str(p) for p in paths]
+    current = pd.DataFrame(
+        [(p, st.st_mtime_ns, st.st_size) for p in dict.fromkeys(path_strs) for st in (os.stat(p),)],
+        columns=['path', 'mtime', 'size']
+    ).astype({'path': 'object', 'mtime': 'int64', 'size': 'int64'})
+
+    cache = load_cache(cache_path)
+    hits = current.merge(cache, on=['path', 'mtime', 'size'], how='inner')
+    misses = current[~current['path'].isin(hits['path'])]
+    if path_strs:
+        print(f"EXIF cache: {len(hits)} images reused, {len(misses)} to read.")
+
+    failed = pd.Series([], dtype=object)
+    if misses.empty:
+        exif_df = hits
+    else:
+        if len(misses) < EXIF_CHUNKSIZE:
+            # Too few to fill one chunk, so starting worker processes would cost more than it saves
+            results = [read_exif_entry(path) for path in tqdm(misses['path'], desc="Reading EXIF data")]
+        else:
+            # Results arrive in completion order, so a slow file doesn't hold back the rest of its chunk
+            with Pool(processes=max_workers) as pool:
+                results = list(tqdm(pool.imap_unordered(read_exif_entry, misses['path'], chunksize=EXIF_CHUNKSIZE),
+                                    total=len(misses), desc="Reading EXIF data"))
+        parsed = misses.merge(
+            pd.DataFrame(results, columns=['path', 'date_time_orig', 'flash_fired', 'ok']), on='path'
+        )
+        failed = parsed.loc[~parsed['ok'], 'path']
+        exif_df = pd.concat([hits, parsed[CACHE_COLUMNS].astype(CACHE_DTYPES)], ignore_index=True)
+
+    # Entries under the scanned roots that this run didn't see belong to moved or deleted images
+    prefixes = tuple(os.path.join(str(root), '') for root in roots)
+    stale = pd.Series(False, index=cache.index)
+    if prefixes:
+        stale = cache['path'].str.startswith(prefixes) & ~cache['path'].isin(current['path'])
+
+    if cache_path and (not misses.empty or stale.any()):
+        # Keep entries for images outside this run (other sites, other scripts)
+        updated_cache = pd.concat([cache[~cache['path'].isin(exif_df['path']) & ~stale],
+                                   exif_df[~exif_df['path'].isin(failed)]],
+                                  ignore_index=True)
+        updated_cache['version'] = pd.Series(CACHE_VERSION, index=updated_cache.index, dtype='int16')
+        try:
+            updated_cache.to_parquet(cache_path, engine='pyarrow', compression='zstd', index=False)
+        except Exception as e:
+            print(f"Warning: could not write EXIF cache '{cache_path}': {e}")
+
+    # Back to input order, with None (not NaN) for missing timestamps
+    exif_df = exif_df.set_index('path').reindex(pd.Index(path_strs, name='path')).reset_index()
+    exif_df['date_time_orig'] = exif_df['date_time_orig'].astype(object).where(exif_df['date_time_orig'].notna(), None)
+    return exif_df[CACHE_COLUMNS].astype(CACHE_DTYPES)